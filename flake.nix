@@ -15,6 +15,7 @@
         myPython = pkgs.python3.withPackages (ps: [
           ps.requests
           ps.feedparser
+          ps.pillow     # optimize_epub.py 压缩图片
         ]);
 
       in
@@ -29,6 +30,7 @@
             pkgs.libwebp  # 解决 WebP 报错
             pkgs.imagemagick # 辅助图片处理
             pkgs.optipng     # 辅助图片压缩
+            pkgs.mitmproxy   # http_replay.py 录制 / 回放
           ];
 
           shellHook = ''
@@ -4,6 +4,8 @@ import sys
 import re
 import os
 
+from recipe_profile import phase, profiled
+
 # --- 配置区 ---
 TARGET_DOMAIN = "https://jidujiaojiaoyu.org/"
 MAX_PAGES_LIMIT = 50 
@@ -13,6 +15,7 @@ def sanitize_filename(name):
     """清理文件名，防止非法字符"""
     return re.sub(r'[\\/*?:"<>|]', "", name).strip().replace(' ', '_')
 
+@profiled()
 def get_all_categories(domain):
     """API 获取分类信息"""
     categories = {} 
@@ -76,25 +79,27 @@ def generate_split_recipes(domain):
     
     name_memo = {}
     
-    for cat_id, cat in categories.items():
-        if cat['count'] == 0: continue # 跳过空分类
+    # 分类树整体记为一个剖析阶段：递归的辅助函数若逐层进出阶段，开销会盖过真实耗时
+    with phase('category_tree'):
+        for cat_id, cat in categories.items():
+            if cat['count'] == 0: continue # 跳过空分类
         
-        # 找到它的根
-        root_id = get_root_id(cat_id, categories)
-        if root_id is None: continue
+            # 找到它的根
+            root_id = get_root_id(cat_id, categories)
+            if root_id is None: continue
         
-        if root_id not in groups:
-            groups[root_id] = []
+            if root_id not in groups:
+                groups[root_id] = []
             
-        # 构建 Feed 数据
-        full_name = get_full_path_name(cat_id, categories, name_memo)
-        base_feed_url = cat['link'].rstrip('/') + '/feed/'
+            # 构建 Feed 数据
+            full_name = get_full_path_name(cat_id, categories, name_memo)
+            base_feed_url = cat['link'].rstrip('/') + '/feed/'
         
-        groups[root_id].append({
-            'name': full_name,
-            'url': base_feed_url,
-            'count': cat['count']
-        })
+            groups[root_id].append({
+                'name': full_name,
+                'url': base_feed_url,
+                'count': cat['count']
+            })
 
     print(f"2. 识别到 {len(groups)} 个顶级系列，准备生成分册...", file=sys.stderr)
 
@@ -118,11 +123,19 @@ def generate_split_recipes(domain):
         print(f"  -> 生成分册: {book_title} (包含 {len(feed_list)} 个子分类)", file=sys.stderr)
 
         # 注入代码
-        recipe_code = f"""import feedparser
-import math
+        recipe_code = f"""import math
+import os
+import sys
 import time
 from calibre.web.feeds.news import BasicNewsRecipe
 
+# --- 仓库里的模块：构建报告与时间预算 (recipe_support)；
+# 性能剖析 (recipe_profile，设置 RECIPE_PROFILE 时才开启) ---
+RECIPE_LIB = os.environ.get('RECIPE_LIB') or {os.path.dirname(os.path.abspath(__file__))!r}
+sys.path.insert(0, RECIPE_LIB)
+from recipe_support import ArticleFiles, BuildReport, Deadline, DeadlineTimeout, fetch_feed, stub_html
+from recipe_profile import profiled
+
 # --- 自定义类 ---
 class MyArticle:
     def __init__(self, title, url, description, author, published, content):
@@ -200,25 +213,76 @@ class JidujiaoSplit(BasicNewsRecipe):
     RSS_PAGE_SIZE = {RSS_PAGE_SIZE}
     MAX_PAGES = {MAX_PAGES_LIMIT}
 
+    # --- 构建报告：超出时间预算未抓取的内容，设置 RECIPE_REPORT 时追加写入该文件 ---
+    REPORT_FILE = os.environ.get('RECIPE_REPORT', '')
+
+    # --- 时间预算：设置 RECIPE_DEADLINE（秒）后，RSS 目录阶段用完预算即停止发起新请求；
+    # 下载正文时按发布时间（最新优先）排队，预算不够的换成占位页 ---
+    DEADLINE = float(os.environ.get('RECIPE_DEADLINE') or 0)
+    DEADLINE_INDEX_SHARE = 0.4        # RSS 目录阶段最多占用的预算比例
+    DEADLINE_RESERVE = 0.15           # 为图片处理与 EPUB 打包保留的预算比例
+    _started = time.time()
+    if DEADLINE:
+        # 正文改由 get_obfuscated_article 下载，才能在下载阶段检查预算；
+        # 单个请求（含 calibre 自己下载的图片）最多占预算的 5%
+        articles_are_obfuscated = True
+        timeout = max(10, min(timeout, DEADLINE * 0.05))
+
+    def __init__(self, *args, **kwargs):
+        BasicNewsRecipe.__init__(self, *args, **kwargs)
+        self.build_report = BuildReport(self.title, self.REPORT_FILE)
+        self.deadline = Deadline(self.DEADLINE, self._started, self.simultaneous_downloads)
+        self.article_files = ArticleFiles()
+
+    def cleanup(self):
+        self.article_files.drop_all()
+        self.build_report.write(self.log)
+
+    def get_obfuscated_article(self, url):
+        '''只在设置了时间预算时启用：排不上号或超出预算的文章换成占位页，其余单次下载后交给 calibre'''
+        share = 1 - self.DEADLINE_RESERVE
+        if self.deadline.admit(url, share):
+            # calibre 从本地文件读正文，<base> 让相对路径的图片仍按原站解析
+            base = f'<base href="{{url}}">'.encode('utf-8')
+            try:
+                return self.deadline.fetch(
+                    self.browser, url, self.timeout, share,
+                    read=lambda r: self.article_files.stream(r, url, self.log, prefix=base))
+            except DeadlineTimeout:
+                pass
+        self.build_report.add('未完成', f'{{url}} (超出时间预算未下载)')
+        return self.article_files.write(stub_html(url, '超出时间预算未下载').encode('utf-8'))
+
+    @profiled()
     def parse_feeds(self):
-        master_feeds_list = []
+        # 按优先级调度 RSS 抓取：先轮一遍各分类第 1 页（最新文章），再逐页往后，
+        # 同一轮内按目录顺序；设置了时间预算时，目录阶段用完即停止发起新请求
+        jobs = []
         for cat in self.MY_CATEGORIES:
-            category_name = cat['name']
-            base_url = cat['url']
-            total_count = cat['count']
-            
-            pages_needed = math.ceil(total_count / self.RSS_PAGE_SIZE)
+            pages_needed = math.ceil(cat['count'] / self.RSS_PAGE_SIZE)
             pages_to_fetch = min(pages_needed, self.MAX_PAGES)
             if pages_to_fetch < 1: pages_to_fetch = 1
             
-            print(f"正在处理: {{category_name}} ({{pages_to_fetch}} 页)")
-            
-            all_articles = []
-            for p in range(1, pages_to_fetch + 1):
+            print(f"正在处理: {{cat['name']}} ({{pages_to_fetch}} 页)")
+            jobs.append({{'cat': cat, 'pages': pages_to_fetch, 'next': 1, 'done': False, 'articles': []}})
+
+        out_of_time = False
+        for p in range(1, self.MAX_PAGES + 1):
+            for job in jobs:
+                if job['done'] or p > job['pages']: continue
+                left = self.deadline.left(self.DEADLINE_INDEX_SHARE)
+                if left is not None and left <= 0:
+                    out_of_time = True
+                    break
+                base_url = job['cat']['url']
                 feed_url = base_url if p == 1 else f"{{base_url}}?paged={{p}}"
+                job['next'] = p + 1
                 try:
-                    f = feedparser.parse(feed_url)
-                    if not f.entries: break
+                    # 自己带超时抓取 RSS，feedparser 只负责解析
+                    f = fetch_feed(self.browser, feed_url, self.deadline.timeout(self.timeout, self.DEADLINE_INDEX_SHARE))
+                    if not f.entries:
+                        job['done'] = True
+                        continue
                     for entry in f.entries:
                         title = entry.get('title', 'Untitled')
                         url   = entry.get('link', '')
@@ -226,13 +290,27 @@ class JidujiaoSplit(BasicNewsRecipe):
                         date  = entry.get('published_parsed', None)
                         date_str = entry.get('published', '')
                         if not url: continue
-                        all_articles.append({{
+                        job['articles'].append({{
                             'title': title, 'url': url, 'description': desc,
                             'author': 'Unknown', 'date': date, 'date_str': date_str, 'content': '' 
                         }})
                 except Exception as e:
                     print(f"  -> 抓取失败: {{e}}")
-            
+            if out_of_time: break
+
+        # 下载阶段的优先级：所有分类的文章按发布时间从新到旧，同一时间按目录顺序
+        if self.deadline:
+            ranked = [a for job in jobs for a in job['articles']]
+            ranked.sort(key=lambda x: x['date'] if x['date'] else time.localtime(0), reverse=True)
+            self.deadline.set_priority(a['url'] for a in ranked)
+
+        master_feeds_list = []
+        for job in jobs:
+            category_name = job['cat']['name']
+            if not job['done'] and job['next'] <= job['pages']:
+                self.build_report.add('未完成', f"{{category_name}}: RSS 第 {{job['next']}}-{{job['pages']}} 页超出时间预算未抓取")
+
+            all_articles = job['articles']
             all_articles.sort(key=lambda x: x['date'] if x['date'] else time.localtime(0))
             
             final_articles = []
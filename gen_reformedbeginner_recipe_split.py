@@ -4,6 +4,8 @@ import sys
 import re
 import os
 
+from recipe_profile import phase, profiled
+
 # --- 配置区 ---
 TARGET_DOMAIN = "https://www.reformedbeginner.net/"
 MAX_PAGES_LIMIT = 50 
@@ -22,6 +24,7 @@ def sanitize_filename(name):
     """清理文件名，防止非法字符"""
     return re.sub(r'[\\/*?:"<>|]', "", name).strip().replace(' ', '_')
 
+@profiled()
 def get_all_categories(domain):
     """API 获取分类信息"""
     categories = {} 
@@ -85,39 +88,41 @@ def generate_split_recipes(domain):
     
     name_memo = {}
     
-    for cat_id, cat in categories.items():
-        if cat['count'] == 0: continue # 跳过空分类
+    # 分类树整体记为一个剖析阶段：递归的辅助函数若逐层进出阶段，开销会盖过真实耗时
+    with phase('category_tree'):
+        for cat_id, cat in categories.items():
+            if cat['count'] == 0: continue # 跳过空分类
         
-        # 找到它的根
-        root_id = get_root_id(cat_id, categories)
-        if root_id is None: continue
+            # 找到它的根
+            root_id = get_root_id(cat_id, categories)
+            if root_id is None: continue
         
-        if root_id not in groups:
-            groups[root_id] = []
+            if root_id not in groups:
+                groups[root_id] = []
             
-        # 构建分类全名 (例如: 类别检索 > 多媒体)
-        full_name = get_full_path_name(cat_id, categories, name_memo)
+            # 构建分类全名 (例如: 类别检索 > 多媒体)
+            full_name = get_full_path_name(cat_id, categories, name_memo)
         
-        # --- 新增：排除逻辑 ---
-        should_skip = False
-        for excluded in EXCLUDED_CATEGORIES:
-            # 如果全名中包含排除列表里的词，则跳过
-            if excluded and excluded in full_name:
-                print(f"  [排除] 跳过分类: {full_name} (匹配规则: {excluded})", file=sys.stderr)
-                should_skip = True
-                break
+            # --- 新增：排除逻辑 ---
+            should_skip = False
+            for excluded in EXCLUDED_CATEGORIES:
+                # 如果全名中包含排除列表里的词，则跳过
+                if excluded and excluded in full_name:
+                    print(f"  [排除] 跳过分类: {full_name} (匹配规则: {excluded})", file=sys.stderr)
+                    should_skip = True
+                    break
         
-        if should_skip:
-            continue
-        # ------------------
+            if should_skip:
+                continue
+            # ------------------
         
-        base_feed_url = cat['link'].rstrip('/') + '/feed/'
+            base_feed_url = cat['link'].rstrip('/') + '/feed/'
         
-        groups[root_id].append({
-            'name': full_name,
-            'url': base_feed_url,
-            'count': cat['count']
-        })
+            groups[root_id].append({
+                'name': full_name,
+                'url': base_feed_url,
+                'count': cat['count']
+            })
 
     print(f"2. 识别到 {len(groups)} 个顶级系列 (已过滤排除项)，准备生成分册...", file=sys.stderr)
 
@@ -145,11 +150,20 @@ def generate_split_recipes(domain):
         print(f"  -> 生成分册: {book_title} (包含 {len(feed_list)} 个子分类)", file=sys.stderr)
 
         # 注入代码
-        recipe_code = f"""import feedparser
-import math
+        recipe_code = f"""import math
+import os
+import sys
 import time
 from calibre.web.feeds.news import BasicNewsRecipe
 
+# --- 仓库里的模块：负缓存、构建报告、时间预算 (recipe_support)；
+# 性能剖析 (recipe_profile，设置 RECIPE_PROFILE 时才开启) ---
+RECIPE_LIB = os.environ.get('RECIPE_LIB') or {os.path.dirname(os.path.abspath(__file__))!r}
+sys.path.insert(0, RECIPE_LIB)
+from recipe_support import (ArticleFiles, BuildReport, Deadline, DeadlineTimeout, NegativeCache,
+                            fetch_feed, http_status, stub_html)
+from recipe_profile import profiled
+
 # --- 自定义类 ---
 class MyArticle:
     def __init__(self, title, url, description, author, published, content):
@@ -227,65 +241,132 @@ class JidujiaoSplit(BasicNewsRecipe):
     RSS_PAGE_SIZE = {RSS_PAGE_SIZE}
     MAX_PAGES = {MAX_PAGES_LIMIT}
 
-    # 新增这三个属性  
+    # 新增这两个属性  
     articles_are_obfuscated = True  
-    temp_files = []  
     fetch_retries = 10  # 重试10次  
 
+    # --- 负缓存：404/410 或反复失败的文章不再走完整重试 ---
+    NEG_CACHE_FILE = os.environ.get('RECIPE_NEG_CACHE', 'neg_cache.json')
+    NEG_CACHE_TTL = 30 * 86400        # 条目自首次失败起保留 30 天
+    NEG_CACHE_RECHECK = 86400         # 首次复查间隔 1 天，之后每次翻倍
+    NEG_CACHE_MAX_FAILURES = 3        # 非 404/410 错误累计失败次数达到后才跳过
+    REPORT_FILE = os.environ.get('RECIPE_REPORT', '')
+
+    # --- 时间预算：设置 RECIPE_DEADLINE（秒）后，超时前停止发起新请求并输出已有内容 ---
+    DEADLINE = float(os.environ.get('RECIPE_DEADLINE') or 0)
+    DEADLINE_INDEX_SHARE = 0.4        # RSS 目录阶段最多占用的预算比例
+    DEADLINE_RESERVE = 0.15           # 为图片处理与 EPUB 打包保留的预算比例
+    _started = time.time()
+    if DEADLINE:
+        # 单个请求（含 calibre 自己下载的图片）最多占预算的 5%
+        timeout = max(10, min(timeout, DEADLINE * 0.05))
+
+    # --- 临时文件：正文分块写盘，单篇设上限；calibre 读完即删，磁盘占用与文章总数无关 ---
+    CHUNK_SIZE = 64 * 1024
+    MAX_ARTICLE_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, *args, **kwargs):
+        BasicNewsRecipe.__init__(self, *args, **kwargs)
+        self.neg_cache = NegativeCache(self.NEG_CACHE_FILE, self.NEG_CACHE_TTL,
+                                       self.NEG_CACHE_RECHECK, self.NEG_CACHE_MAX_FAILURES)
+        self.build_report = BuildReport(self.title, self.REPORT_FILE)
+        self.deadline = Deadline(self.DEADLINE, self._started, self.simultaneous_downloads)
+        self.article_files = ArticleFiles(self.CHUNK_SIZE, self.MAX_ARTICLE_BYTES)
+
+    def cleanup(self):
+        self.article_files.drop_all()
+        try:
+            self.neg_cache.save()
+        except Exception as e:
+            self.log(f'负缓存保存失败: {{e}}')
+        self.build_report.write(self.log)
+
+    def _stub_article(self, url, reason):
+        '''失效文章的占位页，保留目录条目与原文链接'''
+        return self.article_files.write(stub_html(url, reason).encode('utf-8'))
+
     def get_obfuscated_article(self, url):  
-        '''带重试机制的文章下载'''  
-        from calibre.ptempfile import PersistentTemporaryFile  
+        '''带重试机制的文章下载，负缓存中的失效链接与超出时间预算的文章直接返回占位页'''  
         import time  
+
+        reason = self.neg_cache.skip_reason(url)
+        if reason:
+            self.build_report.add('跳过', f'{{url}} ({{reason}})')
+            self.deadline.drop(url)
+            return self._stub_article(url, reason)
+
+        # 按优先级排队：前面还有更新的文章等着下载、剩余预算不够时先让出来
+        share = 1 - self.DEADLINE_RESERVE
+        if not self.deadline.admit(url, share):
+            self.build_report.add('未完成', f'{{url}} (超出时间预算未下载)')
+            return self._stub_article(url, '超出时间预算未下载')
+
+        # 已判定失效的链接到了复查时间只试一次；偶发失败过的仍走完整重试
+        retries = 1 if self.neg_cache.rechecking(url) else self.fetch_retries
           
         result = None  
         count = 0  
           
-        while count < self.fetch_retries:  
+        while count < retries:  
+            left = self.deadline.left(share)
+            if left is not None and left <= 0:
+                self.build_report.add('未完成', f'{{url}} (超出时间预算未下载)')
+                return self._stub_article(url, '超出时间预算未下载')
             try:  
-                # 使用 browser 下载并设置 timeout  
-                response = self.browser.open(url, timeout=self.timeout)  
-                html = response.read()  
-                  
-                # 保存到临时文件  
-                tfile = PersistentTemporaryFile('_fa.html')  
-                tfile.write(html)  
-                tfile.close()  
-                self.temp_files.append(tfile)  
-                result = tfile.name  
+                # 使用 browser 下载并设置 timeout（不超过剩余预算），分块写入临时文件  
+                result = self.deadline.fetch(self.browser, url, self.timeout, share,
+                                             read=lambda r: self.article_files.stream(r, url, self.log))
                   
                 # 成功后退出循环  
                 break  
+            except DeadlineTimeout:
+                # 超时是预算压短的，不算文章失效，不记入负缓存
+                self.build_report.add('未完成', f'{{url}} (超出时间预算未下载)')
+                return self._stub_article(url, '超出时间预算未下载')
             except Exception as e:  
                 count += 1  
-                if count < self.fetch_retries:  
-                    self.log.warn(f'下载失败，正在重试 ({{count}}/{{self.fetch_retries}}): {{url}}')  
+                status = http_status(e)
+                if status not in (404, 410) and count < retries:  
+                    self.log.warn(f'下载失败，正在重试 ({{count}}/{{retries}}): {{url}}')  
                     time.sleep(2)  # 等待2秒后重试  
                 else:  
-                    self.log.error(f'重试 {{self.fetch_retries}} 次后仍失败: {{url}}')  
+                    self.neg_cache.fail(url, status)
+                    self.log.error(f'重试 {{count}} 次后仍失败: {{url}}')  
                     raise  # 抛出异常让 Calibre 记录失败  
-          
+
+        self.neg_cache.ok(url)
         return result
 
+    @profiled()
     def parse_feeds(self):
-        master_feeds_list = []
+        # 按优先级调度 RSS 抓取：先轮一遍各分类第 1 页（最新文章），再逐页往后，
+        # 同一轮内按目录顺序；设置了时间预算时，目录阶段用完即停止发起新请求
+        jobs = []
         for cat in self.MY_CATEGORIES:
-            category_name = cat['name']
-            base_url = cat['url']
-            total_count = cat['count']
-            
-            pages_needed = math.ceil(total_count / self.RSS_PAGE_SIZE)
+            pages_needed = math.ceil(cat['count'] / self.RSS_PAGE_SIZE)
             pages_to_fetch = min(pages_needed, self.MAX_PAGES)
             if pages_to_fetch < 1: pages_to_fetch = 1
             
-            print(f"正在处理: {{category_name}} ({{pages_to_fetch}} 页)")
-            
-            all_articles = []
-            for p in range(1, pages_to_fetch + 1):
+            print(f"正在处理: {{cat['name']}} ({{pages_to_fetch}} 页)")
+            jobs.append({{'cat': cat, 'pages': pages_to_fetch, 'next': 1, 'done': False, 'articles': []}})
+
+        out_of_time = False
+        for p in range(1, self.MAX_PAGES + 1):
+            for job in jobs:
+                if job['done'] or p > job['pages']: continue
+                left = self.deadline.left(self.DEADLINE_INDEX_SHARE)
+                if left is not None and left <= 0:
+                    out_of_time = True
+                    break
+                base_url = job['cat']['url']
                 feed_url = base_url if p == 1 else f"{{base_url}}?paged={{p}}"
+                job['next'] = p + 1
                 try:
-                    # 增加 feedparser 的超时处理
-                    f = feedparser.parse(feed_url)
-                    if not f.entries: break
+                    # 自己带超时抓取 RSS，feedparser 只负责解析
+                    f = fetch_feed(self.browser, feed_url, self.deadline.timeout(self.timeout, self.DEADLINE_INDEX_SHARE))
+                    if not f.entries:
+                        job['done'] = True
+                        continue
                     for entry in f.entries:
                         title = entry.get('title', 'Untitled')
                         url   = entry.get('link', '')
@@ -293,13 +374,27 @@ class JidujiaoSplit(BasicNewsRecipe):
                         date  = entry.get('published_parsed', None)
                         date_str = entry.get('published', '')
                         if not url: continue
-                        all_articles.append({{
+                        job['articles'].append({{
                             'title': title, 'url': url, 'description': desc,
                             'author': 'Unknown', 'date': date, 'date_str': date_str, 'content': '' 
                         }})
                 except Exception as e:
                     print(f"  -> RSS 抓取失败: {{e}}")
-            
+            if out_of_time: break
+
+        # 下载阶段的优先级：所有分类的文章按发布时间从新到旧，同一时间按目录顺序
+        if self.deadline:
+            ranked = [a for job in jobs for a in job['articles']]
+            ranked.sort(key=lambda x: x['date'] if x['date'] else time.localtime(0), reverse=True)
+            self.deadline.set_priority(a['url'] for a in ranked)
+
+        master_feeds_list = []
+        for job in jobs:
+            category_name = job['cat']['name']
+            if not job['done'] and job['next'] <= job['pages']:
+                self.build_report.add('未完成', f"{{category_name}}: RSS 第 {{job['next']}}-{{job['pages']}} 页超出时间预算未抓取")
+
+            all_articles = job['articles']
             all_articles.sort(key=lambda x: x['date'] if x['date'] else time.localtime(0))
             
             final_articles = []
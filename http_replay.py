@@ -0,0 +1,249 @@
+"""
+HTTP 录制 / 回放：让生成器 + ebook-convert 的耗时可以在不同提交之间对比
+
+录制：在 mitmproxy 代理后面跑一次真实构建，把所有 HTTP 往返（分类 API、RSS、
+文章页、图片，以及 TinyLamb 的 index.xml 与文章）连同响应耗时存进录制目录。
+回放：代理直接用录制内容应答，不访问外网，并按原始耗时 × --scale 延迟返回；
+结束时打印总耗时与各类请求数，对比两次提交的结果即可。
+
+用法（需要 mitmproxy，nix 开发环境里已包含）：
+    python http_replay.py record recordings/split -- \\
+        sh -c 'python gen_reformedbeginner_recipe_split.py && \\
+               for r in *.recipe; do ebook-convert "$r" "out/${r%.recipe}.epub"; done'
+    python http_replay.py replay recordings/split --scale 1 --stats before.json -- sh -c '...'
+    python http_replay.py replay recordings/split --scale 0 --stats after.json -- sh -c '...'
+
+被测命令通过 HTTP(S)_PROXY 走代理，并通过 REQUESTS_CA_BUNDLE / SSL_CERT_FILE 信任
+录制目录里的 mitmproxy 证书；RECIPE_NEG_CACHE 指向一次性文件，避免负缓存影响对比。
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+try:
+    from mitmproxy import ctx, http
+except ImportError:  # 作为命令行入口运行时不需要 mitmproxy
+    ctx = http = None
+
+INDEX_FILE = 'index.jsonl'
+BODY_DIR = 'bodies'
+STATS_FILE = 'stats.json'
+CONF_DIR = '.mitmproxy'
+MISS_STATUS = 504  # 回放时遇到没录过的请求
+
+
+def classify(url, content_type):
+    """按请求类型分组统计"""
+    if '/wp-json/' in url:
+        return 'category_api'
+    if '/feed' in url or url.endswith('.xml'):
+        return 'rss'
+    if content_type.startswith('image/'):
+        return 'image'
+    if 'html' in content_type:
+        return 'page'
+    return 'other'
+
+
+# -----------------------
+# mitmproxy 插件（mitmdump -s http_replay.py 加载）
+# -----------------------
+
+class Replay:
+    def __init__(self):
+        self.entries = defaultdict(list)   # (method, url) -> 按录制顺序排列的响应
+        self.served = Counter()            # 回放时每个 key 已用掉几条
+        self.counts = Counter()
+        self.misses = []
+        self.delay = 0.0
+
+    def load(self, loader):
+        loader.add_option('replay_dir', str, 'recording', '录制目录')
+        loader.add_option('replay_mode', str, 'record', 'record 或 replay')
+        # mitmproxy 的选项不支持 float，这里用字符串
+        loader.add_option('replay_latency', str, '1.0', '回放延迟 = 录制耗时 × 此系数，0 表示不延迟')
+
+    def running(self):
+        os.makedirs(os.path.join(ctx.options.replay_dir, BODY_DIR), exist_ok=True)
+        index = os.path.join(ctx.options.replay_dir, INDEX_FILE)
+        if ctx.options.replay_mode == 'record':
+            open(index, 'w').close()
+            return
+        with open(index, encoding='utf-8') as f:
+            for line in f:
+                e = json.loads(line)
+                self.entries[(e['method'], e['url'])].append(e)
+
+    def _body_path(self, digest):
+        return os.path.join(ctx.options.replay_dir, BODY_DIR, digest)
+
+    async def request(self, flow):
+        if ctx.options.replay_mode != 'replay':
+            return
+        key = (flow.request.method, flow.request.pretty_url)
+        recorded = self.entries.get(key)
+        if not recorded:
+            self.counts['miss'] += 1
+            self.misses.append(key[1])
+            flow.response = http.Response.make(MISS_STATUS, b'not recorded', {'X-Replay-Miss': '1'})
+            return
+        # 同一 URL 录到多次（重试等）时按顺序回放，用完后一直用最后一条
+        e = recorded[min(self.served[key], len(recorded) - 1)]
+        self.served[key] += 1
+        delay = e['latency'] * float(ctx.options.replay_latency)
+        if delay > 0:
+            self.delay += delay
+            await asyncio.sleep(delay)
+        with open(self._body_path(e['body']), 'rb') as f:
+            raw = f.read()
+        headers = [(k.encode(), v.encode()) for k, v in e['headers']
+                   if k.lower() not in ('transfer-encoding', 'content-length')]
+        resp = http.Response.make(e['status'], b'', headers)
+        resp.raw_content = raw
+        resp.headers['content-length'] = str(len(raw))
+        flow.response = resp
+        self.counts[e['kind']] += 1
+
+    def response(self, flow):
+        if ctx.options.replay_mode != 'record':
+            return
+        raw = flow.response.raw_content or b''
+        digest = hashlib.sha1(raw).hexdigest()
+        path = self._body_path(digest)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(raw)
+        url = flow.request.pretty_url
+        kind = classify(url, flow.response.headers.get('content-type', ''))
+        entry = {
+            'method': flow.request.method,
+            'url': url,
+            'status': flow.response.status_code,
+            'headers': list(flow.response.headers.items(multi=True)),
+            'body': digest,
+            'kind': kind,
+            'latency': max(0.0, flow.response.timestamp_end - flow.request.timestamp_start),
+        }
+        with open(os.path.join(ctx.options.replay_dir, INDEX_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.counts[kind] += 1
+        self.delay += entry['latency']
+
+    def done(self):
+        stats = {
+            'mode': ctx.options.replay_mode,
+            'latency_scale': float(ctx.options.replay_latency),
+            'requests': sum(v for k, v in self.counts.items() if k != 'miss'),
+            'by_kind': dict(self.counts),
+            'network_seconds': round(self.delay, 3),
+            'misses': self.misses,
+        }
+        with open(os.path.join(ctx.options.replay_dir, STATS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=1)
+
+
+if ctx is not None:
+    addons = [Replay()]
+
+
+# -----------------------
+# 命令行入口：起代理 -> 跑被测命令 -> 汇总
+# -----------------------
+
+def wait_for_port(port, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"mitmdump 启动失败 (退出码 {proc.returncode})")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    sys.exit("等待 mitmdump 超时")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='HTTP 录制 / 回放构建',
+        usage='%(prog)s {record,replay} 录制目录 [选项] -- 被测命令 ...')
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('recording', help='录制目录')
+    parser.add_argument('--scale', type=float, default=1.0, help='回放延迟系数，0 表示不延迟')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--stats', help='把本次统计（含总耗时）另存为 JSON')
+    argv = sys.argv[1:]
+    command = []
+    if '--' in argv:
+        i = argv.index('--')
+        argv, command = argv[:i], argv[i + 1:]
+    args = parser.parse_args(argv)
+    if not command:
+        parser.error('缺少被测命令')
+    if args.mode == 'replay' and not os.path.exists(os.path.join(args.recording, INDEX_FILE)):
+        parser.error(f'{args.recording} 里没有录制内容')
+
+    os.makedirs(args.recording, exist_ok=True)
+    confdir = os.path.join(args.recording, CONF_DIR)
+    mitm = [
+        'mitmdump', '-q', '--listen-host', '127.0.0.1', '--listen-port', str(args.port),
+        '-s', os.path.abspath(__file__),
+        '--set', f'confdir={confdir}',
+        '--set', f'replay_dir={args.recording}',
+        '--set', f'replay_mode={args.mode}',
+        '--set', f'replay_latency={args.scale}',
+    ]
+    if args.mode == 'replay':
+        # 回放时完全不连上游：按 SNI 现场签证书
+        mitm += ['--set', 'connection_strategy=lazy', '--set', 'upstream_cert=false']
+    proxy = subprocess.Popen(mitm)
+    neg_cache_dir = tempfile.mkdtemp(prefix='replay_')
+    try:
+        wait_for_port(args.port, proxy)
+        ca = os.path.join(confdir, 'mitmproxy-ca-cert.pem')
+        proxy_url = f'http://127.0.0.1:{args.port}'
+        env = dict(os.environ)
+        for name in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY'):
+            env[name] = proxy_url
+        for name in ('no_proxy', 'NO_PROXY'):
+            env.pop(name, None)
+        env.update(REQUESTS_CA_BUNDLE=ca, SSL_CERT_FILE=ca, CURL_CA_BUNDLE=ca,
+                   RECIPE_NEG_CACHE=os.path.join(neg_cache_dir, 'neg_cache.json'))
+
+        start = time.perf_counter()
+        code = subprocess.call(command, env=env)
+        seconds = time.perf_counter() - start
+    finally:
+        proxy.send_signal(signal.SIGINT)  # 让插件的 done() 写出统计
+        proxy.wait()
+        shutil.rmtree(neg_cache_dir, ignore_errors=True)
+
+    with open(os.path.join(args.recording, STATS_FILE), encoding='utf-8') as f:
+        stats = json.load(f)
+    stats['seconds'] = round(seconds, 3)
+    stats['exit_code'] = code
+    if args.stats:
+        with open(args.stats, 'w', encoding='utf-8') as f:
+            json.dump(stats, f, ensure_ascii=False, indent=1)
+
+    print(f"[{args.mode}] 耗时 {stats['seconds']} 秒，请求 {stats['requests']} 次，"
+          f"网络延迟合计 {stats['network_seconds']} 秒", file=sys.stderr)
+    for kind, n in sorted(stats['by_kind'].items()):
+        print(f"  {kind:<14} {n}", file=sys.stderr)
+    if stats['misses']:
+        print(f"  !!! {len(stats['misses'])} 个请求不在录制里（返回 {MISS_STATUS}）", file=sys.stderr)
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""
+EPUB 体积优化：把 ebook-convert 生成的 EPUB 压到目标大小以内
+
+按从无损到有损的顺序逐步处理，一旦达到目标就停止：
+  1. 重新打包（最高压缩级别）
+  2. 精简 XHTML/CSS：去注释、折叠空白，删除没有被引用的 CSS 和字体
+  3. 图片阶梯：按 IMAGE_LADDER 逐级降低 JPEG/PNG 质量与尺寸，
+     每一级都从原图重新压缩，避免反复有损压缩
+每一步节省的字节数都会打印出来。文件级的处理在进程池里并行。
+
+用法：
+    python optimize_epub.py output_epubs/*.epub --target 20M
+    python optimize_epub.py book.epub --target 8M -o book.small.epub
+"""
+import argparse
+import io
+import os
+import posixpath
+import re
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 没有 Pillow 时只做无损步骤
+    Image = ImageOps = None
+
+# --- 配置区 ---
+# (JPEG 质量, 尺寸缩放比例)，从轻到重
+IMAGE_LADDER = [
+    (80, 1.0),
+    (70, 0.85),
+    (60, 0.7),
+    (50, 0.55),
+    (40, 0.4),
+]
+PNG_PALETTE_BELOW = 70   # JPEG 质量低于此值的级别，PNG 同时转为 256 色调色板
+
+MARKUP_EXTS = ('.xhtml', '.html', '.htm')
+CSS_EXTS = ('.css',)
+FONT_EXTS = ('.ttf', '.otf', '.woff', '.woff2')
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+
+
+def parse_size(text):
+    """'20M' / '500K' / '1048576' -> 字节数"""
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*', text, re.I)
+    if not m:
+        raise argparse.ArgumentTypeError(f"无法识别的大小: {text}")
+    unit = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[m.group(2).upper()]
+    return int(float(m.group(1)) * unit)
+
+
+def fmt_size(n):
+    return f"{n / 1024 / 1024:.2f} MB"
+
+
+# -----------------------
+# EPUB 读写
+# -----------------------
+
+def read_epub(path):
+    with zipfile.ZipFile(path) as zf:
+        names = zf.namelist()
+        files = {name: zf.read(name) for name in names}
+    return names, files
+
+
+def pack_epub(names, files):
+    """mimetype 必须第一个且不压缩，其余用最高压缩级别"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        if 'mimetype' in files:
+            zf.writestr('mimetype', files['mimetype'], compress_type=zipfile.ZIP_STORED)
+        for name in names:
+            if name == 'mimetype' or name not in files:
+                continue
+            zf.writestr(name, files[name], compress_type=zipfile.ZIP_DEFLATED, compresslevel=9)
+    return buf.getvalue()
+
+
+def find_opf(files):
+    container = files.get('META-INF/container.xml', b'').decode('utf-8', 'ignore')
+    m = re.search(r'full-path="([^"]+)"', container)
+    return m.group(1) if m else None
+
+
+def resolve(base_name, href):
+    """把 base_name 所在目录下的相对 href 转成 zip 内路径"""
+    href = unquote(href.split('#', 1)[0].split('?', 1)[0])
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_name), href))
+
+
+# -----------------------
+# 精简 XHTML/CSS（在进程池里跑）
+# -----------------------
+
+# 注释与需要原样保留的块按出现顺序一起匹配：块里的 "<!--" 不会被当成注释
+_PRESERVE_RE = re.compile(r'<!--.*?-->|<(pre|textarea|script|style)\b.*?</\1\s*>', re.S | re.I)
+_TAG_RE = re.compile(r'(<[^>]*>)')
+# CSS 里的字符串与注释；字符串原样保留
+_CSS_TOKEN_RE = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+
+
+def _collapse_text(chunk):
+    # 只动标签之间的文字，标签与属性原样保留
+    parts = _TAG_RE.split(chunk)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r'\s+', lambda m: '\n' if '\n' in m.group(0) else ' ', parts[i])
+    return ''.join(parts)
+
+
+def minify_markup(text):
+    # 普通注释删掉（条件注释 <!--[if ...]> 保留），pre/textarea/script/style 块原样保留
+    out = []
+    pending = []   # 待折叠的文字，跨过被删掉的注释连在一起
+    pos = 0
+    for m in _PRESERVE_RE.finditer(text):
+        pending.append(text[pos:m.start()])
+        pos = m.end()
+        block = m.group(0)
+        if m.group(1) is None and not block.startswith('<!--['):
+            continue
+        out.append(_collapse_text(''.join(pending)))
+        out.append(block)
+        pending = []
+    pending.append(text[pos:])
+    out.append(_collapse_text(''.join(pending)))
+    return ''.join(out)
+
+
+def minify_css(text):
+    # 先把字符串换成占位符，压缩完再放回去，content: "a , b" 之类不受影响
+    strings = []
+
+    def stash(m):
+        if m.group(1) is None:  # 注释
+            return ''
+        strings.append(m.group(1))
+        return f'\0{len(strings) - 1}\0'
+
+    text = _CSS_TOKEN_RE.sub(stash, text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,])\s*', r'\1', text)
+    text = text.replace(';}', '}').strip()
+    return re.sub(r'\0(\d+)\0', lambda m: strings[int(m.group(1))], text)
+
+
+def minify_file(item):
+    name, raw = item
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return name, raw
+    if name.lower().endswith(CSS_EXTS):
+        data = minify_css(text).encode('utf-8')
+    else:
+        data = minify_markup(text).encode('utf-8')
+    return name, data if len(data) < len(raw) else raw
+
+
+# -----------------------
+# 图片重压缩（在进程池里跑）
+# -----------------------
+
+def recompress_image(item):
+    name, raw, quality, scale = item
+    try:
+        img = Image.open(io.BytesIO(raw))
+        fmt = img.format
+        if fmt not in ('JPEG', 'PNG') or getattr(img, 'is_animated', False):
+            return name, raw
+        icc = img.info.get('icc_profile')
+        # 按 EXIF 方向转正后再处理，写回的 EXIF 里方向标记已清除，其余信息保留
+        img = ImageOps.exif_transpose(img)
+        exif = img.getexif()
+        if scale < 1:
+            w, h = img.size
+            img = img.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+        out = io.BytesIO()
+        if fmt == 'JPEG':
+            if img.mode not in ('RGB', 'L', 'CMYK'):
+                img = img.convert('RGB')
+            img.save(out, 'JPEG', quality=quality, optimize=True, progressive=True,
+                     icc_profile=icc, exif=exif)
+        else:
+            if quality < PNG_PALETTE_BELOW and img.mode in ('RGB', 'RGBA'):
+                img = img.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+            img.save(out, 'PNG', optimize=True, icc_profile=icc, exif=exif)
+        data = out.getvalue()
+    except Exception:
+        return name, raw
+    return name, data if len(data) < len(raw) else raw
+
+
+# -----------------------
+# 各个步骤
+# -----------------------
+
+def step_markup(names, files, pool):
+    jobs = [(n, files[n]) for n in names if n.lower().endswith(MARKUP_EXTS + CSS_EXTS)]
+    for name, data in pool.map(minify_file, jobs, chunksize=16):
+        files[name] = data
+
+    # 找出被 XHTML 引用的 CSS，再找出被保留的 CSS / XHTML 引用的字体
+    markup = [n for n in names if n.lower().endswith(MARKUP_EXTS)]
+    css_used = set()
+    for n in markup:
+        text = files[n].decode('utf-8', 'ignore')
+        for href in re.findall(r'<link\b[^>]*\bhref=["\']([^"\']+)["\']', text, re.I):
+            css_used.add(resolve(n, href))
+    pending = list(css_used)
+    while pending:  # @import 链
+        n = pending.pop()
+        text = files.get(n, b'').decode('utf-8', 'ignore')
+        for href in re.findall(r'@import\s+(?:url\()?["\']?([^"\')\s;]+)', text, re.I):
+            target = resolve(n, href)
+            if target not in css_used:
+                css_used.add(target)
+                pending.append(target)
+    font_used = set()
+    for n in markup + [c for c in css_used if c in files]:
+        text = files[n].decode('utf-8', 'ignore')
+        for href in re.findall(r'url\(\s*["\']?([^"\')]+)["\']?\s*\)', text, re.I):
+            font_used.add(resolve(n, href))
+
+    unused = {n for n in names if n.lower().endswith(CSS_EXTS) and n not in css_used}
+    unused |= {n for n in names if n.lower().endswith(FONT_EXTS) and n not in font_used}
+    if unused:
+        drop_from_manifest(files, unused)
+        for n in unused:
+            files.pop(n, None)
+
+
+def drop_from_manifest(files, removed):
+    opf = find_opf(files)
+    if not opf or opf not in files:
+        return
+    text = files[opf].decode('utf-8')
+
+    def keep(m):
+        href = re.search(r'\bhref=["\']([^"\']+)["\']', m.group(0))
+        if href and resolve(opf, href.group(1)) in removed:
+            return ''
+        return m.group(0)
+
+    files[opf] = re.sub(r'[ \t]*<(?:opf:)?item\b[^>]*/>[ \t]*\n?', keep, text).encode('utf-8')
+
+
+def step_images(names, files, originals, quality, scale, pool):
+    jobs = [(n, originals[n], quality, scale) for n in names
+            if n in files and n.lower().endswith(IMAGE_EXTS)]
+    for name, data in pool.map(recompress_image, jobs, chunksize=4):
+        files[name] = data
+
+
+def optimize(path, target, out_path=None, workers=None):
+    names, files = read_epub(path)
+    before = os.path.getsize(path)
+    size = before
+    report = []
+
+    def record(label):
+        nonlocal size
+        new_size = len(pack_epub(names, files))
+        report.append((label, size - new_size))
+        size = new_size
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        steps = [('重新打包', lambda: None),
+                 ('精简 XHTML/CSS', lambda: step_markup(names, files, pool))]
+        if Image is not None:
+            originals = dict(files)
+            for quality, scale in IMAGE_LADDER:
+                steps.append((f'图片 质量{quality} 缩放{scale:.2f}',
+                              lambda q=quality, s=scale: step_images(names, files, originals, q, s, pool)))
+        else:
+            print("  未安装 Pillow，跳过图片压缩", file=sys.stderr)
+
+        for label, run in steps:
+            if size <= target:
+                break
+            run()
+            record(label)
+
+    if not report:
+        print(f"{os.path.basename(path)}: {fmt_size(before)}，已在目标 {fmt_size(target)} 以内", file=sys.stderr)
+        if out_path and out_path != path:
+            with open(path, 'rb') as src, open(out_path, 'wb') as dst:
+                dst.write(src.read())
+        return before
+
+    data = pack_epub(names, files)
+    out_path = out_path or path
+    tmp = out_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, out_path)
+
+    print(f"{os.path.basename(path)}: {fmt_size(before)} -> {fmt_size(len(data))} (目标 {fmt_size(target)})",
+          file=sys.stderr)
+    for label, saved in report:
+        print(f"  {label:<24} 节省 {saved:>10} 字节", file=sys.stderr)
+    if len(data) > target:
+        print("  !!! 所有步骤用完仍未达到目标大小", file=sys.stderr)
+    return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='把 EPUB 压到目标大小以内')
+    parser.add_argument('epubs', nargs='+')
+    parser.add_argument('--target', type=parse_size, required=True, help='每本书的目标大小，如 20M')
+    parser.add_argument('-o', '--output', help='输出路径（只处理一本时可用，默认原地覆盖）')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='并行进程数，默认 CPU 核数')
+    args = parser.parse_args()
+    if args.output and len(args.epubs) > 1:
+        parser.error('-o 只能在处理单个文件时使用')
+    for path in args.epubs:
+        optimize(path, args.target, args.output, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+可选的性能剖析（默认关闭）
+
+设置环境变量 RECIPE_PROFILE=<输出目录> 后，被 @profiled() 标记的阶段会：
+  - 由后台线程按 RECIPE_PROFILE_INTERVAL 秒（默认 0.005）采样调用栈，
+    写出 <阶段>.<pid>.folded（flamegraph.pl / speedscope 可直接读取的折叠栈格式）
+  - 用 tracemalloc 记录阶段内的内存峰值，写出 <阶段>.<pid>.mem.txt
+    （调用次数、累计耗时、峰值，以及占用创新高时拍下的前 30 个分配点）
+    峰值是整个进程的 tracemalloc 峰值，其他线程（并发下载等）同时分配的内存也算在内；
+    分配点快照很慢，每个阶段在占用比上次快照高出 SNAPSHOT_GROWTH 倍、且距上次
+    至少 SNAPSHOT_INTERVAL 秒时才重拍一次
+
+生成器脚本直接 import 本模块，生成的 recipe 与 tiny_lamb_recipe.recipe 从 RECIPE_LIB
+（默认为仓库目录 / 当前目录）import。未开启剖析时 profiled() 原样返回函数、
+phase() 什么也不做，不需要另外判断。
+
+递归函数不要加 @profiled()：每层递归都会进出一次阶段，开销会盖过真实耗时；
+改用 phase() 包住调用它的那段循环。
+
+用法示例：
+    RECIPE_PROFILE=prof python gen_reformedbeginner_recipe_split.py
+    RECIPE_PROFILE=prof ebook-convert xxx.recipe out.epub
+    flamegraph.pl prof/JidujiaoSplit.parse_feeds.*.folded > parse_feeds.svg
+"""
+import atexit
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+try:
+    import tracemalloc
+except ImportError:  # 个别精简版 Python 没有 tracemalloc，只做 CPU 采样
+    tracemalloc = None
+
+PROFILE_DIR = os.environ.get('RECIPE_PROFILE', '')
+SAMPLE_INTERVAL = float(os.environ.get('RECIPE_PROFILE_INTERVAL') or 0.005)
+TOP_ALLOCATIONS = 30
+SNAPSHOT_GROWTH = 1.2      # 占用比上次快照高出 20% 才重拍
+SNAPSHOT_INTERVAL = 30.0   # 同一阶段两次快照至少间隔的秒数
+
+_lock = threading.Lock()
+_phases = {}    # 阶段名 -> 统计
+_active = {}    # 线程 id -> 当前所在阶段名列表（支持嵌套）
+_sampler = None
+
+
+class _Phase:
+    def __init__(self, name):
+        self.name = name
+        self.stacks = Counter()
+        self.calls = 0
+        self.seconds = 0.0
+        self.peak = 0
+        self.top_current = 0
+        self.snapshot = None
+        self.snapshot_at = None
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    name = code.co_name.replace(';', ':')
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample_loop():
+    me = threading.get_ident()
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        frames = sys._current_frames()
+        with _lock:
+            for tid, names in _active.items():
+                frame = frames.get(tid)
+                if tid == me or not names or frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                _phases[names[-1]].stacks[';'.join(reversed(stack))] += 1
+
+
+def _start():
+    global _sampler
+    if _sampler is not None:
+        return
+    if tracemalloc is not None and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _sampler = threading.Thread(target=_sample_loop, name='recipe-profile', daemon=True)
+    _sampler.start()
+    atexit.register(dump)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """把一段代码记为一个剖析阶段；同一线程内同名阶段嵌套（递归）时只算最外层"""
+    if not PROFILE_DIR:
+        yield
+        return
+    tid = threading.get_ident()
+    with _lock:
+        _start()
+        names = _active.setdefault(tid, [])
+        if name in names:
+            nested = True
+        else:
+            nested = False
+            # 没有其他阶段在跑时才重置峰值，避免并发阶段互相抹掉
+            if tracemalloc is not None and not any(_active.values()):
+                tracemalloc.reset_peak()
+            names.append(name)
+            _phases.setdefault(name, _Phase(name))
+    if nested:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        current = peak = 0
+        if tracemalloc is not None:
+            current, peak = tracemalloc.get_traced_memory()
+        with _lock:
+            names.remove(name)
+            p = _phases[name]
+            p.calls += 1
+            p.seconds += elapsed
+            p.peak = max(p.peak, peak)
+            # take_snapshot 要遍历所有分配记录，只在占用明显创新高时拍，并且限制频率
+            now = time.monotonic()
+            take_snapshot = (tracemalloc is not None
+                             and current > p.top_current * SNAPSHOT_GROWTH
+                             and (p.snapshot_at is None or now - p.snapshot_at >= SNAPSHOT_INTERVAL))
+            if take_snapshot:
+                p.top_current = current
+                p.snapshot_at = now
+        if take_snapshot:
+            snapshot = tracemalloc.take_snapshot()
+            with _lock:
+                p.snapshot = snapshot
+
+
+def profiled(name=None):
+    """装饰器：把函数整体记为一个剖析阶段，未开启剖析时原样返回函数"""
+    def deco(fn):
+        if not PROFILE_DIR:
+            return fn
+        phase_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(phase_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def dump():
+    """把各阶段的折叠栈与内存报告写到 RECIPE_PROFILE 目录"""
+    if not PROFILE_DIR:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    pid = os.getpid()
+    with _lock:
+        phases = list(_phases.values())
+    for p in phases:
+        base = os.path.join(PROFILE_DIR, f"{p.name}.{pid}")
+        with open(base + '.folded', 'w', encoding='utf-8') as f:
+            for stack, count in p.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(base + '.mem.txt', 'w', encoding='utf-8') as f:
+            f.write(f"phase: {p.name}\n")
+            f.write(f"calls: {p.calls}\n")
+            f.write(f"seconds: {p.seconds:.3f}\n")
+            f.write(f"samples: {sum(p.stacks.values())}\n")
+            f.write(f"peak_bytes: {p.peak}\n")
+            f.write("# peak_bytes 是阶段内整个进程的 tracemalloc 峰值，包含其他线程同时分配的内存；\n")
+            f.write("# 并发阶段（多线程下载）之间会互相叠加，只能作为上限参考\n")
+            if p.snapshot is not None:
+                f.write(f"\ntop allocations (current {p.top_current} bytes at exit):\n")
+                for stat in p.snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                    f.write(f"{stat}\n")
+    print(f"性能剖析结果已写入 {PROFILE_DIR}/ ({len(phases)} 个阶段)", file=sys.stderr)
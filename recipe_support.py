@@ -0,0 +1,315 @@
+"""
+recipe 共用的辅助逻辑：负缓存、构建报告、时间预算、文章临时文件、失效文章占位页
+
+生成的 recipe 与 tiny_lamb_recipe.recipe 都从 RECIPE_LIB（默认为仓库目录 /
+当前目录）加载本模块，逻辑只在这里维护一份。
+
+负缓存（RECIPE_NEG_CACHE，默认 neg_cache.json）按 URL 记录：
+    status      最近一次的 HTTP 状态码（网络错误等为 None）
+    failures    累计失败次数
+    first/last  首次 / 最近一次失败时间
+    next_check  下次复查时间，首次间隔 recheck 秒，之后每次翻倍，最长 ttl
+404/410 或失败次数达到 max_failures 的条目在 next_check 之前直接跳过；
+到了复查时间只试一次。条目自首次失败起 ttl 秒后作废。
+
+时间预算（RECIPE_DEADLINE，秒）：目录阶段与正文下载阶段各自按比例截止；
+下载阶段还按优先级（最新文章优先）决定谁先被换成占位页，见 Deadline.admit。
+单次请求的超时被预算压缩后超时的，抛 DeadlineTimeout，不记入负缓存。
+"""
+import json
+import os
+import socket
+import threading
+import time
+
+
+def http_status(e):
+    """从 mechanize / urllib 的异常里取 HTTP 状态码，取不到返回 None"""
+    code = getattr(e, 'code', None)
+    return code if isinstance(code, int) else None
+
+
+def is_timeout(e):
+    """socket 超时；urllib / mechanize 会把它包在 URLError.reason 里"""
+    timeouts = (socket.timeout, TimeoutError)
+    return isinstance(e, timeouts) or isinstance(getattr(e, 'reason', None), timeouts)
+
+
+class DeadlineTimeout(Exception):
+    """请求超时，但超时时间是时间预算压缩出来的：不是站点本身的问题"""
+
+
+def fetch_feed(browser, url, timeout):
+    """
+    带超时抓取 RSS 再交给 feedparser 解析。feedparser.parse(url) 自己抓取时没有超时，
+    一个卡住的请求就能吃掉整个目录阶段的预算。404/410 视为没有更多条目。
+    """
+    import feedparser
+    try:
+        response = browser.open(url, timeout=timeout)
+        try:
+            raw = response.read()
+        finally:
+            response.close()
+    except Exception as e:
+        if http_status(e) in (404, 410):
+            return feedparser.parse(b'')
+        raise
+    return feedparser.parse(raw)
+
+
+def stub_html(url, reason):
+    """失效文章的占位页，保留目录条目与原文链接"""
+    return (f'<html><head><title>{url}</title></head><body>'
+            f'<h1>原文暂时无法访问</h1>'
+            f'<div class="entry-content"><p>{reason}：<a href="{url}">{url}</a></p></div>'
+            f'</body></html>')
+
+
+class NegativeCache:
+    def __init__(self, path, ttl=30 * 86400, recheck=86400, max_failures=3):
+        self.path = path
+        self.ttl = ttl
+        self.recheck = recheck
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _entries(self):
+        # 调用方持有 self._lock
+        if self._data is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception:
+                data = {}
+            now = time.time()
+            self._data = {u: e for u, e in data.items() if now - e.get('first', 0) < self.ttl}
+        return self._data
+
+    def _blocked(self, e):
+        return e['status'] in (404, 410) or e['failures'] >= self.max_failures
+
+    def skip_reason(self, url):
+        """已确认失效且未到复查时间的 URL 返回失效原因，否则返回 None"""
+        with self._lock:
+            e = self._entries().get(url)
+        if not e or time.time() >= e['next_check'] or not self._blocked(e):
+            return None
+        if e['status'] in (404, 410):
+            return f"HTTP {e['status']}"
+        return f"连续失败 {e['failures']} 次"
+
+    def rechecking(self, url):
+        """本该跳过、但已到复查时间的 URL：只试一次。偶发失败过的 URL 仍走完整重试"""
+        with self._lock:
+            e = self._entries().get(url)
+        return bool(e) and self._blocked(e) and time.time() >= e['next_check']
+
+    def fail(self, url, status=None):
+        with self._lock:
+            now = time.time()
+            e = self._entries().setdefault(url, {'status': None, 'failures': 0, 'first': now})
+            e['failures'] += 1
+            if status:
+                e['status'] = status
+            e['last'] = now
+            delay = self.recheck * 2 ** (e['failures'] - 1)
+            e['next_check'] = now + min(delay, self.ttl)
+
+    def ok(self, url):
+        with self._lock:
+            self._entries().pop(url, None)
+
+    def save(self):
+        """原子写回；本次构建没用到负缓存时不动文件"""
+        if self._data is None:
+            return
+        tmp = self.path + '.tmp'
+        with self._lock:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class BuildReport:
+    """跳过 / 未完成的内容，构建结束时写进日志；给了 path 时追加写入该文件"""
+
+    def __init__(self, title, path=''):
+        self.title = title
+        self.path = path
+        self.lines = []
+        self._lock = threading.Lock()
+
+    def add(self, kind, msg):
+        with self._lock:
+            self.lines.append(f'[{kind}] {msg}')
+
+    def write(self, log):
+        if not self.lines:
+            return
+        log(f'构建报告：共 {len(self.lines)} 条')
+        for line in self.lines:
+            log('  ' + line)
+        if self.path:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(f'== {self.title} ==\n')
+                f.write('\n'.join(self.lines) + '\n\n')
+
+
+class Deadline:
+    """
+    时间预算。seconds 为 0 时不限时，left() 返回 None，admit() 一律放行。
+
+    正文下载阶段 calibre 按目录顺序分发文章，而目录里最新的文章未必排在前面。
+    set_priority() 给出按优先级排好的 URL，admit() 再按每个下载线程
+    “两次取文章之间的间隔”（含图片下载与处理）估算剩余预算还能下几篇：
+    排在这篇前面、还没轮到的文章已经能把预算用完时，这篇直接换成占位页，
+    把时间留给优先级更高的文章。
+    """
+
+    def __init__(self, seconds, started=None, workers=1):
+        self.seconds = seconds
+        self.started = time.time() if started is None else started
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._ranks = {}
+        self._decided = {}         # 名次 -> 放行 / 换成占位页
+        self._last = {}            # 线程 id -> (上次取文章的时间, 是否放行)
+        self._intervals = []
+
+    def __bool__(self):
+        return bool(self.seconds)
+
+    def left(self, share=1.0):
+        """距本阶段截止还剩多少秒；不限时返回 None"""
+        if not self.seconds:
+            return None
+        return self.started + self.seconds * share - time.time()
+
+    def timeout(self, default, share=1.0):
+        """单次请求的超时：不超过本阶段剩余时间"""
+        left = self.left(share)
+        return default if left is None else max(1, min(default, left))
+
+    def fetch(self, browser, url, default, share=1.0, read=lambda r: r.read()):
+        """
+        以不超过本阶段剩余时间的超时打开 url，再用 read(response) 读取。
+        超时时间比 default 短且确实超时时抛 DeadlineTimeout，调用方不应记入负缓存
+        """
+        timeout = self.timeout(default, share)
+        try:
+            return read(browser.open(url, timeout=timeout))
+        except Exception as e:
+            if timeout < default and is_timeout(e):
+                raise DeadlineTimeout(f'{url}: {timeout:.0f} 秒超时（受时间预算限制）') from e
+            raise
+
+    def set_priority(self, urls):
+        """urls 按优先级从高到低排列；重复的 URL 取最高名次"""
+        with self._lock:
+            for url in urls:
+                self._ranks.setdefault(url, len(self._ranks))
+
+    def drop(self, url):
+        """不需要下载的文章（如负缓存跳过），不再算作排队等候"""
+        with self._lock:
+            rank = self._ranks.get(url)
+            if rank is not None:
+                self._decided.setdefault(rank, False)
+
+    def admit(self, url, share=1.0):
+        """下载前调用：返回 False 表示这篇应换成占位页"""
+        left = self.left(share)
+        if left is None:
+            return True
+        now = time.time()
+        tid = threading.get_ident()
+        with self._lock:
+            last = self._last.get(tid)
+            if last and last[1]:
+                self._intervals.append(now - last[0])
+            ok = left > 0
+            rank = self._ranks.get(url)
+            if rank in self._decided:
+                # 同一篇出现在多个分类里：沿用第一次的决定
+                ok = ok and self._decided[rank]
+            elif rank is not None:
+                if ok and self._intervals:
+                    affordable = left * self.workers / (sum(self._intervals) / len(self._intervals))
+                    waiting = rank - sum(1 for r in self._decided if r < rank)
+                    ok = waiting < affordable
+                self._decided[rank] = ok
+            self._last[tid] = (now, ok)
+        return ok
+
+
+class ArticleFiles:
+    """
+    get_obfuscated_article 用的文章临时文件：正文分块写盘，单篇设上限。
+    calibre 在同一线程里读完上一篇才会再来取下一篇，所以新建文件时删掉
+    本线程的上一个，磁盘占用与文章总数无关；剩下的在 drop_all() 里删掉。
+    """
+
+    def __init__(self, chunk_size=64 * 1024, max_bytes=8 * 1024 * 1024):
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._paths = set()
+
+    def _new(self):
+        from calibre.ptempfile import PersistentTemporaryFile
+        prev = getattr(self._local, 'path', None)
+        if prev:
+            self.drop(prev)
+        tfile = PersistentTemporaryFile('_fa.html')
+        self._local.path = tfile.name
+        with self._lock:
+            self._paths.add(tfile.name)
+        return tfile
+
+    def drop(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        with self._lock:
+            self._paths.discard(path)
+
+    def drop_all(self):
+        with self._lock:
+            paths = list(self._paths)
+        for path in paths:
+            self.drop(path)
+
+    def write(self, data, prefix=b''):
+        tfile = self._new()
+        tfile.write(prefix + data)
+        tfile.close()
+        return tfile.name
+
+    def stream(self, response, url, log, prefix=b''):
+        """按块把响应写入临时文件，超过 max_bytes 的部分截断丢弃；失败时删掉写了一半的文件"""
+        tfile = self._new()
+        try:
+            tfile.write(prefix)
+            size = 0
+            while True:
+                chunk = response.read(self.chunk_size)
+                if not chunk:
+                    break
+                if size + len(chunk) > self.max_bytes:
+                    tfile.write(chunk[:self.max_bytes - size])
+                    log.warn(f'文章超过 {self.max_bytes >> 20} MB，已截断: {url}')
+                    break
+                tfile.write(chunk)
+                size += len(chunk)
+        except Exception:
+            tfile.close()
+            self.drop(tfile.name)
+            raise
+        finally:
+            response.close()
+        tfile.close()
+        return tfile.name